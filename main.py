@@ -1,14 +1,20 @@
 import os
+
+# Keep Tesseract single-threaded process-wide (set before pytesseract loads):
+# page-level parallelism across worker processes beats OpenMP threads inside a
+# single page, and N workers x 4 OMP threads oversubscribes the machine.
+# Children inherit this, so it covers the OCR worker processes too.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+import concurrent.futures
+import hashlib
+from pathlib import Path
 import streamlit as st
 import pytesseract
-from pdf2image import convert_from_bytes
-import pdfplumber
 from PIL import Image
 import fitz  # PyMuPDF
 import tempfile
 import sys
-import io
-from fpdf import FPDF
 from contextlib import contextmanager
 
 st.set_page_config(page_title="OCR PDF Extractor", layout="centered")
@@ -18,10 +24,6 @@ st.write("Upload scanned or text-based PDFs. This app extracts and displays the
 # Sidebar for configuration
 with st.sidebar:
     st.header("Configuration")
-    poppler_path = st.text_input("Poppler Path (optional)", 
-                               placeholder="e.g., C:\\poppler\\bin",
-                               help="Path to Poppler binaries if not in system PATH")
-    
     # Check for Tesseract installation
     tesseract_path = st.text_input("Tesseract Path (optional)",
                                  placeholder="e.g., C:\\Program Files\\Tesseract-OCR",
@@ -35,15 +37,30 @@ with st.sidebar:
     st.subheader("OCR Options")
     ocr_dpi = st.slider("DPI for OCR", min_value=72, max_value=600, value=300, 
                       help="Higher DPI may improve OCR accuracy but uses more memory")
-    ocr_lang = st.selectbox("OCR Language", 
+    max_ocr_pixels = st.slider("Max OCR pixels per page (long side)",
+                             min_value=1500, max_value=6000, value=3300,
+                             help="Caps the rendered size of oversize pages so OCR time stays bounded")
+    ocr_lang = st.selectbox("OCR Language",
                           options=["eng", "fra", "deu", "spa", "ita", "por", "chi_sim", "jpn", "kor"],
                           index=0,
                           help="Select language for OCR")
     
-    fallback_all_pages = st.checkbox("Force OCR on all pages", 
+    fallback_all_pages = st.checkbox("Force OCR on all pages",
                                   value=False, 
                                   help="Use OCR for all pages, even when text is extractable")
 
+# Probe Tesseract once per process (keyed on the configured binary) instead of
+# forking the version subprocess on every rerun
+@st.cache_resource(show_spinner=False)
+def _tess_version(tesseract_cmd):
+    return pytesseract.get_tesseract_version()
+
+try:
+    _tess_version(pytesseract.pytesseract.tesseract_cmd)
+except Exception:
+    st.sidebar.warning("⚠️ Tesseract not found. OCR will fail until it is "
+                       "installed or its path is set above.")
+
 # Error handling wrapper
 @contextmanager
 def error_handling(stage_name):
@@ -54,47 +71,92 @@ def error_handling(stage_name):
         st.info("Try adjusting the settings in the sidebar or try another PDF.")
         return None
 
-# Check for Poppler installation
-def is_poppler_installed(custom_path=None):
-    try:
-        from pdf2image.exceptions import PDFInfoNotInstalledError
-        test_file = os.path.join(tempfile.gettempdir(), "test.pdf")
-        with open(test_file, "wb") as f:
-            f.write(b"%PDF-1.7\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj 2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj 3 0 obj<</Type/Page/MediaBox[0 0 3 3]>>endobj\nxref\n0 4\n0000000000 65535 f\n0000000010 00000 n\n0000000053 00000 n\n0000000102 00000 n\n\ntrailer<</Size 4/Root 1 0 R>>\nstartxref\n149\n%EOF\n")
-        convert_from_bytes(open(test_file, "rb").read(), dpi=200, first_page=1, last_page=1, 
-                          poppler_path=custom_path)
-        os.remove(test_file)
-        return True
-    except Exception:
-        return False
-
-# Create PDF from extracted text
+# OCR worker helpers (must be module-level so they pickle for the process pool)
+def _init_ocr_worker(tesseract_cmd):
+    # Keep each Tesseract instance single-threaded; page-level parallelism
+    # across processes beats OpenMP threads inside one page.
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+def _ocr_batch(args):
+    indices, list_path, lang, out_dir = args
+    # One Tesseract invocation per batch: the engine loads its language model
+    # once and walks the image list itself, separating pages with form feeds.
+    text = pytesseract.image_to_string(list_path, lang=lang)
+    pages = text.split("\f")
+    if len(pages) < len(indices):
+        pages += [""] * (len(indices) - len(pages))
+    # Spill each page's text to disk so the parent tracks paths, not text,
+    # while the rest of the document is still being OCRed
+    out_paths = []
+    for idx, page_text in zip(indices, pages):
+        out_path = os.path.join(out_dir, f"{idx:05d}.txt")
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(page_text)
+        out_paths.append((idx, out_path))
+    return out_paths
+
+# Render pages lazily so only a handful of page images are alive at once.
+# Pages come out grayscale and thresholded to 1-bpp: Tesseract binarizes
+# internally anyway, and bilevel input is a fraction of the RGB footprint.
+def _iter_page_images(pdf_bytes, dpi, max_pixels, page_numbers=None):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        numbers = range(len(doc)) if page_numbers is None else page_numbers
+        for i in numbers:
+            page = doc.load_page(i)
+            # Cap the long side so oversize pages (posters, drawings) don't
+            # explode into tens of megapixels at the slider DPI.
+            long_side_in = max(page.rect.width, page.rect.height, 1) / 72
+            page_dpi = max(72, min(dpi, int(max_pixels / long_side_in)))
+            pix = page.get_pixmap(dpi=page_dpi, colorspace=fitz.csGRAY)
+            # samples_mv is a zero-copy memoryview over the pixmap (unlike
+            # .samples, which builds a fresh bytes object on every access);
+            # frombuffer wraps it in place and .point() copies out of it
+            img = Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv,
+                                   "raw", "L", 0, 1)
+            bw = img.point(lambda p: 255 if p > 180 else 0, mode="1")
+            del img  # release the buffer view before the pixmap is collected
+            yield i, bw
+
+# Create PDF from extracted text (cached so re-clicks and reruns reuse the
+# already-generated document)
+@st.cache_data(show_spinner=False)
 def create_pdf_from_text(text, title="Extracted Text"):
+    # deferred: only needed once a download is requested
+    from fpdf import FPDF
+    from fpdf.enums import XPos, YPos
+
     pdf = FPDF()
     pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    
+
     # Add title
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(200, 10, txt=title, ln=True, align='C')
+    pdf.set_font("Helvetica", 'B', 16)
+    pdf.cell(200, 10, text=title, align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(10)
-    
-    # Add text content
-    pdf.set_font("Arial", size=12)
-    
-    # Split text into lines and add to PDF
-    lines = text.split('\n')
-    for line in lines:
-        # Handle very long lines
-        if len(line) > 0:
-            # Encode special characters
-            try:
-                pdf.multi_cell(0, 5, txt=line)
-            except Exception:
-                # If encoding issues, try to clean the text
-                pdf.multi_cell(0, 5, txt="[Content with special characters removed]")
-    
-    return pdf.output(dest="S").encode('latin-1')
+
+    # Add text content: clean to latin-1 once up front instead of catching an
+    # encoding exception per line, and lay out in ~4 KB blocks rather than one
+    # multi_cell call per line. new_x must return to the left margin: fpdf2's
+    # default leaves the cursor at the right edge, where the next full-width
+    # multi_cell has no room to render.
+    pdf.set_font("Helvetica", size=12)
+    safe = text.encode("latin-1", "replace").decode("latin-1")
+
+    block, block_len = [], 0
+    for line in safe.split('\n'):
+        block.append(line)
+        block_len += len(line) + 1
+        if block_len >= 4096:
+            pdf.multi_cell(0, 5, text='\n'.join(block),
+                           new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            block, block_len = [], 0
+    if block:
+        pdf.multi_cell(0, 5, text='\n'.join(block),
+                       new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    # fpdf2 returns a bytearray; older fpdf returned a latin-1 str
+    out = pdf.output()
+    return out.encode("latin-1") if isinstance(out, str) else bytes(out)
 
 uploaded_file = st.file_uploader("Upload a PDF file", type=["pdf"])
 
@@ -105,86 +167,159 @@ if uploaded_file:
     file_bytes = uploaded_file.read()
     page_count = 0
     
-    # Save temporarily for processing
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(file_bytes)
-        tmp_pdf_path = tmp_file.name
+    # Content-addressed result cache: a rerun (or app restart) with the same
+    # file and settings skips extraction entirely.
+    mode = "ocr" if fallback_all_pages else "auto"
+    cache_key = hashlib.sha256(file_bytes).hexdigest()
+    cache_path = Path(tempfile.gettempdir()) / f"ocr_{cache_key}_{ocr_dpi}_{max_ocr_pixels}_{ocr_lang}_{mode}.txt"
+    cache_hit = False
+    if cache_path.is_file():
+        try:
+            extracted_text = cache_path.read_text(encoding="utf-8")
+            cache_hit = bool(extracted_text.strip())
+        except Exception:
+            extracted_text = ""
+    if cache_hit:
+        st.success("✅ Loaded cached extraction for this file")
     
     # Try to get page count
     try:
-        with fitz.open(tmp_pdf_path) as doc:
+        with fitz.open(stream=file_bytes, filetype="pdf") as doc:
             page_count = len(doc)
             st.info(f"PDF has {page_count} pages")
     except Exception as e:
         st.warning(f"Could not determine page count: {str(e)}")
     
-    # Process with different methods based on settings
-    if not fallback_all_pages:
-        # First try pdfplumber (for text-based PDFs)
+    # Per-page text quality from the fast PyMuPDF pass; None marks pages whose
+    # text layer is missing or too thin to trust, so only those get OCR.
+    per_page_text = []
+    if not fallback_all_pages and not cache_hit:
         with st.spinner("Trying text-based extraction..."):
             try:
-                with pdfplumber.open(tmp_pdf_path) as pdf:
-                    for i, page in enumerate(pdf.pages):
-                        page_text = page.extract_text() or ""
-                        if page_text.strip():
-                            extracted_text += f"\n--- Page {i+1} ---\n{page_text}"
-                
-                if len(extracted_text.strip()) > 100:
-                    st.success("✅ Text-based extraction successful!")
+                with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+                    for page in doc:
+                        page_text = page.get_text("text") or ""
+                        per_page_text.append(page_text if len(page_text.strip()) > 20 else None)
             except Exception as e:
                 st.warning(f"Text-based extraction error: {str(e)}")
-                extracted_text = ""  # Reset if failed
-    
-    # If little or no text or forced OCR, use OCR
-    if len(extracted_text.strip()) < 100 or fallback_all_pages:
-        st.warning("Text-based extraction failed or forced OCR. Switching to OCR mode 📸")
-        
-        # Check if Poppler is installed before attempting OCR
-        poppler_installed = is_poppler_installed(poppler_path if poppler_path else None)
-        
-        if not poppler_installed:
-            st.error("""
-            ❌ Poppler is not installed or not in PATH. OCR cannot proceed.
-            
-            To install Poppler:
-            
-            1. Download Poppler for Windows from: https://github.com/oschwartz10612/poppler-windows/releases/
-            2. Extract the ZIP file to a folder (e.g., C:\\poppler)
-            3. Either:
-               - Add the bin directory to your PATH (e.g., C:\\poppler\\bin), or
-               - Specify the bin directory path in the sidebar
-            4. Restart your application
-            """)
+                per_page_text = []  # Reset if failed
+
+    # Decide which pages still need OCR
+    needs_ocr = []
+    if not cache_hit:
+        if fallback_all_pages or not per_page_text:
+            needs_ocr = list(range(page_count))
+            per_page_text = [None] * page_count
         else:
-            extracted_text = ""  # Reset text if using OCR
-            with st.spinner("Performing OCR on document..."):
-                try:
-                    images = convert_from_bytes(file_bytes, dpi=ocr_dpi, 
-                                              poppler_path=poppler_path if poppler_path else None)
-                    st.success(f"✅ Successfully converted {len(images)} pages to images for OCR")
-                    
-                    # Progress bar for OCR
-                    progress_bar = st.progress(0)
-                    
-                    for i, image in enumerate(images):
-                        progress_bar.progress((i+1)/len(images))
+            needs_ocr = [i for i, t in enumerate(per_page_text) if t is None]
+            if not needs_ocr:
+                st.success("✅ Text-based extraction successful!")
+
+    # OCR only the pages that need it
+    ocr_failed = False
+    if not cache_hit and needs_ocr:
+        total_pages = len(needs_ocr)
+        results = {}
+
+        if len(needs_ocr) < page_count:
+            st.warning(f"OCR needed for {len(needs_ocr)} of {page_count} pages 📸")
+        else:
+            st.warning("Text-based extraction failed or forced OCR. Switching to OCR mode 📸")
+
+        # Stream only the pages that need OCR straight out of PyMuPDF;
+        # peak memory stays at a handful of pages.
+        page_images = _iter_page_images(file_bytes, ocr_dpi, max_ocr_pixels, needs_ocr)
+        with st.spinner("Performing OCR on document..."):
+            try:
+                # Progress bar for OCR; a single st.empty slot is updated in
+                # place so long runs don't pile up widgets and round-trips
+                status = st.empty()
+                progress_bar = st.progress(0)
+
+                max_workers = os.cpu_count() or 1
+                # Batch pages so each Tesseract invocation amortizes its
+                # model load over many images, capped at 50 per batch.
+                batch_size = min(50, max(1, -(-total_pages // max_workers)))
+
+                # Pages are written straight to disk, so RAM holds only the
+                # page currently being rendered.
+                ocr_tmpdir = tempfile.TemporaryDirectory()
+                batch_dir = Path(ocr_tmpdir.name)
+
+                batches = []
+                batch_indices, batch_paths = [], []
+                for i, image in page_images:
+                    page_path = batch_dir / f"page_{i:05d}.png"
+                    image.save(page_path)
+                    batch_indices.append(i)
+                    batch_paths.append(str(page_path))
+                    if len(batch_indices) >= batch_size:
+                        batches.append((batch_indices, batch_paths))
+                        batch_indices, batch_paths = [], []
+                if batch_indices:
+                    batches.append((batch_indices, batch_paths))
+
+                done = 0
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=max_workers,
+                        initializer=_init_ocr_worker,
+                        initargs=(pytesseract.pytesseract.tesseract_cmd,)) as executor:
+                    futures = []
+                    for n, (indices, paths) in enumerate(batches):
+                        list_path = batch_dir / f"batch_{n:03d}.txt"
+                        list_path.write_text("\n".join(paths))
+                        futures.append(executor.submit(
+                            _ocr_batch, (indices, str(list_path), ocr_lang,
+                                         str(batch_dir))))
+                    # Throttle UI updates to ~50 over the whole run; every
+                    # update costs a browser round-trip
+                    step = max(1, total_pages // 50)
+                    last_shown = 0
+                    for future in concurrent.futures.as_completed(futures):
                         try:
-                            text = pytesseract.image_to_string(image, lang=ocr_lang)
-                            extracted_text += f"\n--- Page {i+1} ---\n{text}"
-                            st.info(f"Processed page {i+1}/{len(images)}")
+                            for idx, out_path in future.result():
+                                results[idx] = out_path
+                                done += 1
                         except Exception as e:
-                            st.error(f"OCR error on page {i+1}: {str(e)}")
-                    
-                    progress_bar.empty()
-                    
-                except Exception as e:
-                    st.error(f"❌ OCR processing error: {str(e)}")
+                            st.error(f"OCR error: {str(e)}")
+                        if done - last_shown >= step or done >= total_pages:
+                            progress_bar.progress(done/max(total_pages, done, 1))
+                            status.text(f"Processed {done}/{total_pages} pages")
+                            last_shown = done
 
-    # Clean up the temporary file
-    try:
-        os.unlink(tmp_pdf_path)
-    except:
-        pass
+                # Splice OCR output back into the per-page text, reading the
+                # spilled page files only now that everything is done
+                if results and len(per_page_text) <= max(results):
+                    per_page_text += [None] * (max(results) + 1 - len(per_page_text))
+                for idx, out_path in results.items():
+                    per_page_text[idx] = Path(out_path).read_text(encoding="utf-8")
+
+                ocr_tmpdir.cleanup()
+
+                progress_bar.empty()
+                status.empty()
+
+            except Exception as e:
+                st.error(f"❌ OCR processing error: {str(e)}")
+
+        # A failed batch (missing traineddata, worker crash, ...) leaves pages
+        # without a result; flag it so the partial text is never persisted and
+        # the next run retries instead of serving it from the cache
+        ocr_failed = any(i not in results for i in needs_ocr)
+        if ocr_failed:
+            st.warning("⚠️ Some pages failed OCR, so this result will not be "
+                       "cached. Rerun to retry the failed pages.")
+
+    if not cache_hit:
+        extracted_text = "".join(f"\n--- Page {i+1} ---\n{t}"
+                                 for i, t in enumerate(per_page_text) if t is not None)
+
+    # Persist the result so later reruns hit the cache (complete results only)
+    if not cache_hit and not ocr_failed and extracted_text.strip():
+        try:
+            cache_path.write_text(extracted_text, encoding="utf-8")
+        except Exception:
+            pass
 
     # Show result
     if extracted_text.strip():
@@ -197,13 +332,19 @@ if uploaded_file:
             st.download_button("⬇️ Download Text", extracted_text, file_name="extracted_text.txt")
         
         with col2:
-            # Create and download as PDF
-            try:
-                pdf_bytes = create_pdf_from_text(extracted_text, title=f"Extracted from {uploaded_file.name}")
-                st.download_button("⬇️ Download as PDF", pdf_bytes, 
-                                 file_name="extracted_text.pdf", mime="application/pdf")
-            except Exception as e:
-                st.error(f"Error creating PDF: {str(e)}")
+            # Generating the PDF is expensive for long extractions, so build it
+            # only once the user asks for it instead of on every rerun. The
+            # request is keyed to this upload's hash so a new file starts over
+            # instead of inheriting a stale click.
+            if st.button("🛠️ Prepare PDF"):
+                st.session_state["pdf_requested"] = cache_key
+            if st.session_state.get("pdf_requested") == cache_key:
+                try:
+                    pdf_bytes = create_pdf_from_text(extracted_text, title=f"Extracted from {uploaded_file.name}")
+                    st.download_button("⬇️ Download as PDF", pdf_bytes,
+                                     file_name="extracted_text.pdf", mime="application/pdf")
+                except Exception as e:
+                    st.error(f"Error creating PDF: {str(e)}")
     else:
         st.error("❌ Failed to extract any text. Check the PDF or try another one.")
         
@@ -223,7 +364,7 @@ if uploaded_file:
            - Try the "Force OCR on all pages" option
            
         4. **If extraction fails**:
-           - Verify Poppler and Tesseract are correctly installed
+           - Verify Tesseract is correctly installed
            - Try processing smaller sections of the PDF
            - For secure or DRM-protected PDFs, OCR might be the only option
         """)
\ No newline at end of file